@@ -1,118 +1,235 @@
 # calendar_builder_full.py
 
-import os, datetime as dt
+import os, argparse, hashlib, datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 from pathlib import Path
 from dotenv import load_dotenv
-import requests, pandas as pd
-from dateutil.relativedelta import relativedelta, FR, TH
-from openpyxl import load_workbook
+import orjson, requests, numpy as np, pandas as pd
+from pandas.api.types import union_categoricals
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from openpyxl import Workbook, load_workbook
 
 # ------------------------------------------------------------------ CONFIG
 load_dotenv()
 CLIENT  = os.getenv("TE_CLIENT",  "d7ce0826836148f")
 SECRET  = os.getenv("TE_SECRET",  "uk5cjdr5i1qzbzr")
+TE_URL    = "https://api.tradingeconomics.com/calendar"
+TE_PARAMS = {"c": f"{CLIENT}:{SECRET}", "f": "json"}    # fixed part of every query
+# comma-separated, e.g. "united states,euro area"; empty → one all-country window
+COUNTRIES = [c.strip() for c in os.getenv("TE_COUNTRIES", "").split(",") if c.strip()]
 
 START_STATIC = dt.date(2025, 7, 1)
 END_STATIC   = dt.date(2026, 1, 31)
-EXCEL_FILE = Path("macro_calendar.xlsx")
+# announced one-off dates, parsed once at import
+FOMC_DATES   = pd.to_datetime(["2025-07-30","2025-09-17","2025-11-05","2025-12-17","2026-01-28"])
+ECB_DATES    = pd.to_datetime(["2025-07-17","2025-09-11","2025-10-23","2025-12-04","2026-01-22"])
+SG_GDP_DATES = pd.to_datetime(["2025-07-12","2025-10-11","2026-01-10"])
+PARQUET_FILE = Path("macro_calendar.parquet")   # canonical store
+EXCEL_FILE   = Path("macro_calendar.xlsx")      # export only (--export-xlsx)
+CALENDAR_COLUMNS = ["Date","Country","Event","Actual","Previous","Forecast","Impact","Source"]
+CATEGORY_COLUMNS = ["Country","Event","Source"]
+TE_COLUMNS = {      # TradingEconomics field → calendar column
+    "Date":"Date", "Country":"Country", "Event":"Event",
+    "Actual":"Actual", "Previous":"Previous",
+    "Forecast":"Forecast", "Consensus":"Forecast",
+    "Importance":"Impact"
+}
+
+# one pooled session for every TE call → TCP/TLS handshake is paid once
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+))
+TE_TIMEOUT = (5, 15)    # (connect, read) seconds — fail fast on a dead endpoint, then retry
 
 # ------------------------------------------------------------------ 1. LIVE DATA
+def fetch_te(url, params):
+    r = SESSION.get(url, params=params, timeout=TE_TIMEOUT)
+    r.raise_for_status()
+    payload = orjson.loads(r.content)
+    if not payload:
+        return pd.DataFrame()
+    # project while building: keep every mapped field that any record carries
+    present = set().union(*payload)
+    cols = [c for c in TE_COLUMNS if c in present]
+    live = pd.DataFrame.from_records(payload, columns=cols)
+    live.columns = [TE_COLUMNS[c] for c in cols]
+    return live
+
 def fetch_live_te():
     today = dt.date.today()
     horizon = today + dt.timedelta(days=14)
-    url = "https://api.tradingeconomics.com/calendar"
-    params = {
-        "d1": today.strftime("%Y-%m-%d"),
-        "d2": horizon.strftime("%Y-%m-%d"),
-        "c":  f"{CLIENT}:{SECRET}",
-        "f":  "json"
-    }
+    if COUNTRIES:
+        queries = [(f"{TE_URL}/country/{quote(c)}/{today}/{horizon}", TE_PARAMS) for c in COUNTRIES]
+    else:
+        queries = [(TE_URL, {"d1": today.isoformat(), "d2": horizon.isoformat(), **TE_PARAMS})]
     print("→ Fetching live TradingEconomics window …")
-    r = requests.get(url, params=params, timeout=30)
-    r.raise_for_status()
-    live = pd.DataFrame(r.json())
-    if live.empty:
+    # IO-bound → threads overlap the round-trips; workers share the pooled SESSION
+    with ThreadPoolExecutor(max_workers=min(len(queries), 8)) as ex:
+        frames = [df for df in ex.map(lambda q: fetch_te(*q), queries) if not df.empty]
+    if not frames:
         print("⚠️ Live feed empty — continuing with static data only.")
         return pd.DataFrame()
-    keep = {
-        "Date":"Date", "Country":"Country", "Event":"Event",
-        "Actual":"Actual", "Previous":"Previous",
-        "Forecast":"Forecast", "Consensus":"Forecast",
-        "Importance":"Impact"
-    }
-    live = live[[c for c in keep if c in live.columns]].rename(columns=keep)
-    live["Date"] = pd.to_datetime(live["Date"]).dt.date
+    live = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    live["Date"] = pd.to_datetime(live["Date"]).dt.normalize()
     live["Source"] = f"TE_live_{today}"
+    for col in CATEGORY_COLUMNS:
+        live[col] = live[col].astype("category")
+    if "Impact" in live:
+        # nullable: TE occasionally sends "Importance": null
+        live["Impact"] = live["Impact"].astype("Int8")
     return live
 
 # ------------------------------------------------------------------ 2. STATIC SCHEDULED EVENTS
-def monthly_on(weekday_rule, base_day):
-    def date_in_month(d):
-        return (d + relativedelta(day=base_day, weekday=weekday_rule))
-    return date_in_month
+def thursday_on_or_after(months, base_day):
+    target = months + pd.Timedelta(days=base_day - 1)
+    return target + pd.to_timedelta((3 - target.weekday) % 7, unit="D")
 
 def generate_static():
-    rows = []
-    cur = START_STATIC
-    nfp_rule   = monthly_on(FR(1), 1)
-    cpi_rule   = monthly_on(TH(0), 10)
-    ppi_rule   = monthly_on(TH(0), 12)
-    retail_rule= monthly_on(TH(0), 14)
-    gdp_rule   = monthly_on(TH(0), 28)
-    
-    while cur <= END_STATIC:
-        rows += [
-            (nfp_rule(cur),   "United States", "Non-Farm Payrolls",             3),
-            (cpi_rule(cur),   "United States", "Consumer Price Index YoY",      2),
-            (ppi_rule(cur),   "United States", "Producer Price Index YoY",      2),
-            (retail_rule(cur),"United States", "Retail Sales MoM",              2),
-            (gdp_rule(cur),   "United States", "GDP Advance Estimate QoQ",      3),
-        ]
-        cur += relativedelta(months=1)
-    
-    fomc = ["2025-07-30","2025-09-17","2025-11-05","2025-12-17","2026-01-28"]
-    ecb  = ["2025-07-17","2025-09-11","2025-10-23","2025-12-04","2026-01-22"]
-    for d in fomc:
-        rows.append((dt.date.fromisoformat(d), "United States", "FOMC Meeting & Rate Decision", 3))
-    for d in ecb:
-        rows.append((dt.date.fromisoformat(d), "Euro Area",     "ECB Interest Rate Decision",  3))
-    for d in ["2025-07-12","2025-10-11","2026-01-10"]:
-        rows.append((dt.date.fromisoformat(d), "Singapore", "GDP Advance Estimate QoQ", 2))
-    
-    df = pd.DataFrame(rows, columns=["Date","Country","Event","Impact"])
-    df["Forecast"]=df["Previous"]=df["Actual"]=""; df["Source"]="Static_Schedule"
-    return df
-
-# ------------------------------------------------------------------ 3. MERGE & WRITE EXCEL
-def write_excel(live_df, static_df):
-    combined = pd.concat([live_df, static_df], ignore_index=True)\
-                 .drop_duplicates(subset=["Date","Country","Event"])\
-                 .sort_values("Date")
-
-    mode = "a" if EXCEL_FILE.exists() else "w"
-    print(f"→ Writing to {EXCEL_FILE} ({'update' if mode == 'a' else 'create'}) …")
-
-    if mode == "a":
-        with pd.ExcelWriter(EXCEL_FILE, engine="openpyxl", mode="a", if_sheet_exists="replace") as xls:
-            combined.to_excel(xls, sheet_name="Calendar", index=False)
-            try:
-                wb = load_workbook(EXCEL_FILE)
-                old = pd.read_excel(EXCEL_FILE, sheet_name="Glossary") if "Glossary" in wb.sheetnames else pd.DataFrame()
-            except Exception:
-                old = pd.DataFrame()
-            new_gloss = combined[["Event"]].drop_duplicates().assign(Purpose="", Frequency="")
-            gloss = pd.concat([old, new_gloss]).drop_duplicates(subset=["Event"]).reset_index(drop=True)
-            gloss.to_excel(xls, sheet_name="Glossary", index=False)
-    else:
-        with pd.ExcelWriter(EXCEL_FILE, engine="openpyxl", mode="w") as xls:
-            combined.to_excel(xls, sheet_name="Calendar", index=False)
-            new_gloss = combined[["Event"]].drop_duplicates().assign(Purpose="", Frequency="")
-            new_gloss.to_excel(xls, sheet_name="Glossary", index=False)
+    months = pd.date_range(START_STATIC, END_STATIC, freq="MS")
+    nfp    = pd.date_range(START_STATIC, END_STATIC, freq="WOM-1FRI")
+    schedule = [
+        (nfp,                              "United States", "Non-Farm Payrolls",            3),
+        (thursday_on_or_after(months, 10), "United States", "Consumer Price Index YoY",     2),
+        (thursday_on_or_after(months, 12), "United States", "Producer Price Index YoY",     2),
+        (thursday_on_or_after(months, 14), "United States", "Retail Sales MoM",             2),
+        (thursday_on_or_after(months, 28), "United States", "GDP Advance Estimate QoQ",     3),
+        (FOMC_DATES,                       "United States", "FOMC Meeting & Rate Decision", 3),
+        (ECB_DATES,                        "Euro Area",     "ECB Interest Rate Decision",   3),
+        (SG_GDP_DATES,                     "Singapore",     "GDP Advance Estimate QoQ",     2),
+    ]
+    dates, countries, events, impacts = zip(*schedule)
+    sizes = [len(d) for d in dates]
+
+    # one allocation per column; repeated strings become integer-coded categories
+    return pd.DataFrame({
+        "Date":     np.concatenate([d.values for d in dates]),
+        "Country":  pd.Categorical(np.repeat(countries, sizes)),
+        "Event":    pd.Categorical(np.repeat(events, sizes)),
+        "Impact":   np.repeat(np.asarray(impacts, dtype="int8"), sizes),
+        "Forecast": "", "Previous": "", "Actual": "",
+        "Source":   pd.Categorical(np.repeat("Static_Schedule", sum(sizes))),
+    })
+
+# ------------------------------------------------------------------ 3. MERGE & STORE
+def merge_calendar(live_df, static_df):
+    frames = [df for df in (live_df, static_df) if not df.empty]
+    if len(frames) > 1:
+        # align categories up front, otherwise concat falls back to object dtype
+        cats = {c: union_categoricals([df[c] for df in frames]).categories for c in CATEGORY_COLUMNS}
+        frames = [df.assign(**{c: df[c].cat.set_categories(cats[c]) for c in cats}) for df in frames]
+    combined = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    # dedup on one int64 hash per row instead of comparing three (mostly string) columns
+    key = pd.util.hash_pandas_object(combined[["Date","Country","Event"]], index=False)
+    keep = np.flatnonzero(~key.duplicated().to_numpy())
+    # dedup + stable date order folded into one positional take → the blocks are copied once;
+    # fixed column layout + stable sort → identical inputs give an identical frame (and digest)
+    keep = keep[combined["Date"].to_numpy()[keep].argsort(kind="stable")]
+    return combined.take(keep).reindex(columns=CALENDAR_COLUMNS)
+
+def calendar_digest(combined):
+    return hashlib.sha256(pd.util.hash_pandas_object(combined, index=False).to_numpy().tobytes()).hexdigest()
+
+def hash_path(path):
+    # <file>.hash holds the digest of the calendar last written to <file>
+    return Path(f"{path}.hash")
 
+def up_to_date(path, digest):
+    sidecar = hash_path(path)
+    if path.exists() and sidecar.exists() and sidecar.read_text() == digest:
+        print(f"✓ {path} already up to date — skipping write.")
+        return True
+    return False
+
+def stamp(path, digest):
+    hash_path(path).write_text(digest)
+
+def write_parquet(combined, digest):
+    if up_to_date(PARQUET_FILE, digest):
+        return
+    print(f"→ Writing to {PARQUET_FILE} …")
+    combined.to_parquet(PARQUET_FILE, engine="pyarrow", compression="zstd", index=False)
+    stamp(PARQUET_FILE, digest)
     print(f"✅ Done – {len(combined)} total events now in calendar.")
 
+# ------------------------------------------------------------------ 4. EXCEL EXPORT
+def cell_value(v):
+    # Excel-edge values: blanks → empty cells, midnight timestamps → yyyy-mm-dd dates
+    if v is None or (isinstance(v, str) and v == ""):
+        return None
+    if isinstance(v, dt.datetime) and v.time() == dt.time(0):
+        return v.date()
+    return v
+
+def read_sheet(ws):
+    # write-only workbooks carry no <dimension>, so read-only rows can come back ragged
+    rows = [list(row) for row in ws.values]
+    width = max(map(len, rows), default=0)
+    return [row + [None] * (width - len(row)) for row in rows]
+
+def sheet_rows(df):
+    yield list(df.columns)
+    for row in df.itertuples(index=False, name=None):
+        yield [None if pd.isna(v) else cell_value(v) for v in row]
+
+def create_excel(combined):
+    # fresh file → stream rows through a write-only workbook, no Cell objects held
+    wb = Workbook(write_only=True)
+    new_gloss = combined[["Event"]].drop_duplicates().assign(Purpose="", Frequency="")
+    for name, df in (("Calendar", combined), ("Glossary", new_gloss)):
+        ws = wb.create_sheet(name)
+        for row in sheet_rows(df):
+            ws.append(row)
+    wb.save(EXCEL_FILE)
+
+def update_excel(combined):
+    # single read-only pass over the existing workbook for the Glossary
+    old_rows = None
+    try:
+        wb = load_workbook(EXCEL_FILE, read_only=True, data_only=True)
+        if "Glossary" in wb.sheetnames:
+            old_rows = read_sheet(wb["Glossary"])
+        wb.close()
+    except Exception:
+        old_rows = None
+    old = pd.DataFrame(old_rows[1:], columns=old_rows[0]) if old_rows else pd.DataFrame()
+    # only events the Glossary doesn't know yet; usually none
+    events = combined["Event"].drop_duplicates()
+    added = events[~events.isin(old["Event"] if "Event" in old else [])]
+    new_gloss = pd.DataFrame({"Event": added, "Purpose": "", "Frequency": ""})
+
+    # replace the Calendar (and the Glossary if it grew), keeping the rest of the workbook
+    with pd.ExcelWriter(EXCEL_FILE, engine="openpyxl", mode="a", if_sheet_exists="replace") as xls:
+        # dates (not datetimes) at the Excel edge so the cells keep a YYYY-MM-DD format
+        combined.assign(Date=combined["Date"].dt.date)\
+                .to_excel(xls, sheet_name="Calendar", index=False)
+        if not new_gloss.empty:
+            pd.concat([old, new_gloss], ignore_index=True).to_excel(xls, sheet_name="Glossary", index=False)
+
+def write_excel(combined, digest):
+    if up_to_date(EXCEL_FILE, digest):
+        return
+    if not EXCEL_FILE.exists():
+        print(f"→ Writing to {EXCEL_FILE} (create) …")
+        create_excel(combined)
+    else:
+        print(f"→ Writing to {EXCEL_FILE} (update) …")
+        update_excel(combined)
+    stamp(EXCEL_FILE, digest)
+    print(f"✅ Exported {len(combined)} events to {EXCEL_FILE}.")
+
 # ------------------------------------------------------------------ MAIN
 if __name__ == "__main__":
-    live = fetch_live_te()
-    static = generate_static()
-    write_excel(live, static)
+    parser = argparse.ArgumentParser(description="Build the macro calendar.")
+    parser.add_argument("--export-xlsx", action="store_true",
+                        help=f"also export the calendar to {EXCEL_FILE}")
+    args = parser.parse_args()
+
+    combined = merge_calendar(fetch_live_te(), generate_static())
+    digest = calendar_digest(combined)
+    write_parquet(combined, digest)
+    if args.export_xlsx:
+        write_excel(combined, digest)